@@ -24,6 +24,7 @@ from .blocks import (
     T,
     Upsample,
     UpsampleInterpolate,
+    UpsamplePixelShuffle,
     default,
     exists,
 )
@@ -87,6 +88,15 @@ def UpsampleItem(
             in_channels=channels,
             out_channels=out_channels,
         )
+    elif upsample_mode == "pixel_shuffle":
+        Item = SelectX(UpsamplePixelShuffle)
+        return Item(  # type: ignore
+            dim=dim,
+            factor=factor,
+            kernel_size=upsample_kernel_size,
+            in_channels=channels,
+            out_channels=out_channels,
+        )
     else:
         Item = SelectX(UpsampleInterpolate)
         return Item(  # type: ignore
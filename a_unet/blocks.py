@@ -1,10 +1,21 @@
+from collections import OrderedDict
 from math import pi
-from typing import Any, Callable, Optional, Sequence, Type, TypeVar, Union, List
+from typing import (
+    Any,
+    Callable,
+    List,
+    Optional,
+    Sequence,
+    Type,
+    TypeVar,
+    Union,
+    cast,
+)
 
 import torch
 import torch.nn.functional as F
-from einops import pack, rearrange, reduce, repeat, unpack
-from torch import Tensor, einsum, nn
+from einops import rearrange, reduce
+from torch import Tensor, nn
 from typing_extensions import TypeGuard
 
 V = TypeVar("V")
@@ -65,6 +76,17 @@ def Module(modules: Sequence[nn.Module], forward_fn: Callable):
     return Module()
 
 
+def to_channels_last(m: nn.Module) -> nn.Module:
+    """Converts 2D/3D conv weights to channels last in-place, inputs should be
+    converted too with x.contiguous(memory_format=torch.channels_last)"""
+    for sub in m.modules():
+        if isinstance(sub, (nn.Conv2d, nn.ConvTranspose2d)):
+            sub.to(memory_format=torch.channels_last)
+        elif isinstance(sub, (nn.Conv3d, nn.ConvTranspose3d)):
+            sub.to(memory_format=torch.channels_last_3d)
+    return m
+
+
 class Sequential(nn.Module):
     """Custom Sequential that includes all args"""
 
@@ -100,12 +122,10 @@ class Packed(Sequential):
     """Packs, and transposes non-channel dims, useful for attention-like view"""
 
     def forward(self, x: Tensor, *args) -> Tensor:
-        x, ps = pack([x], "b d *")
-        x = rearrange(x, "b d n -> b n d")
+        spatial_shape = x.shape[2:]
+        x = x.flatten(2).transpose(1, 2).contiguous()
         x = super().forward(x, *args)
-        x = rearrange(x, "b n d -> b d n")
-        x = unpack(x, ps, "b d *")[0]
-        return x
+        return x.transpose(1, 2).unflatten(2, spatial_shape)
 
 
 def Repeat(m: Union[nn.Module, Type[nn.Module]], times: int) -> Any:
@@ -187,6 +207,33 @@ def UpsampleInterpolate(
     )
 
 
+def UpsamplePixelShuffle(
+    dim: int,
+    out_channels: int,
+    factor: int = 2,
+    kernel_size: int = 3,
+    conv_t=Conv,
+    **kwargs,
+) -> nn.Module:
+    """Upsamples with a low resolution conv followed by a pixel shuffle"""
+    assert kernel_size % 2 == 1, "upsample kernel size must be odd"
+    conv = conv_t(
+        dim=dim,
+        out_channels=out_channels * factor**dim,
+        kernel_size=kernel_size,
+        padding=(kernel_size - 1) // 2,
+        **kwargs,
+    )
+    if dim == 2:
+        return nn.Sequential(conv, nn.PixelShuffle(factor))
+    # Generic pixel shuffle, e.g. "b (c r0) x0 -> b c (x0 r0)" for dim=1
+    rs, xs = [f"r{i}" for i in range(dim)], [f"x{i}" for i in range(dim)]
+    xrs = [f"({x} {r})" for x, r in zip(xs, rs)]
+    pattern = f"b (c {' '.join(rs)}) {' '.join(xs)} -> b c {' '.join(xrs)}"
+    factors = {r: factor for r in rs}
+    return Module([conv], lambda x: rearrange(conv(x), pattern, **factors))
+
+
 def ConvBlock(
     dim: int,
     in_channels: int,
@@ -224,7 +271,14 @@ def ResnetBlock(
     if in_channels != out_channels:
         conv = Conv(in_channels=in_channels, out_channels=out_channels)
 
-    return Module([conv_block, conv], lambda x: conv_block(x) + conv(x))
+    def forward(x: Tensor) -> Tensor:
+        y, r = conv_block(x), conv(x)
+        # Residual add in-place into the block output when autograd is off and
+        # the sum keeps y's dtype and shape (e.g. not bf16 y + fp32 x in autocast)
+        can_inplace = y.dtype == r.dtype and y.shape == r.shape
+        return y.add_(r) if can_inplace and not y.requires_grad else y + r
+
+    return Module([conv_block, conv], forward)
 
 
 class GRN(nn.Module):
@@ -236,11 +290,12 @@ class GRN(nn.Module):
         self.gamma = nn.Parameter(torch.zeros(1, channels, *ones))
         self.beta = nn.Parameter(torch.zeros(1, channels, *ones))
         self.norm_dims = [d + 2 for d in range(dim)]
+        self.eps = 1e-6
 
     def forward(self, x: Tensor) -> Tensor:
-        Gx = torch.norm(x, p=2, dim=self.norm_dims, keepdim=True)
-        Nx = Gx / (Gx.mean(dim=1, keepdim=True) + 1e-6)
-        return self.gamma * (x * Nx) + self.beta + x
+        Gx = torch.linalg.vector_norm(x, dim=self.norm_dims, keepdim=True)
+        Nx = Gx * Gx.mean(dim=1, keepdim=True).add_(self.eps).reciprocal_()
+        return torch.addcmul(x + self.beta, self.gamma, x * Nx)
 
 
 def ConvNextV2Block(dim: int, channels: int) -> nn.Module:
@@ -273,44 +328,54 @@ def ConvNextV2Block(dim: int, channels: int) -> nn.Module:
 
 
 def AttentionBase(features: int, head_features: int, num_heads: int) -> nn.Module:
-    scale = head_features**-0.5
     mid_features = head_features * num_heads
     to_out = nn.Linear(in_features=mid_features, out_features=features, bias=False)
 
     def forward(
         q: Tensor, k: Tensor, v: Tensor, mask: Optional[Tensor] = None
     ) -> Tensor:
-        h = num_heads
-        # Split heads
-        q, k, v = map(lambda t: rearrange(t, "b n (h d) -> b h n d", h=h), (q, k, v))
-        # Compute similarity matrix and add eventual mask
-        sim = einsum("... n d, ... m d -> ... n m", q, k) * scale
-        # Get attention matrix with softmax
-        attn = sim.softmax(dim=-1)
-        # Compute values
-        out = einsum("... n m, ... m d -> ... n d", attn, v)
-        out = rearrange(out, "b h n d -> b n (h d)")
+        (b, n, _), h = q.shape, num_heads
+        # Split heads as b h n d views over b n h d memory, read in place by the
+        # fused kernels (no transpose copy, unlike permuting heads to the front)
+        q, k, v = map(
+            lambda t: t.reshape(*t.shape[:2], h, -1).transpose(1, 2), (q, k, v)
+        )
+        # Fused similarity, eventual mask, softmax and values (flash/mem-efficient),
+        # the head_features**-0.5 scale is applied in-kernel by default
+        out = F.scaled_dot_product_attention(q, k, v, attn_mask=mask)
+        out = out.transpose(1, 2).reshape(b, n, mid_features)
         return to_out(out)
 
     return Module([to_out], forward)
 
 
-def LinearAttentionBase(features: int, head_features: int, num_heads: int) -> nn.Module:
+def LinearAttentionBase(
+    features: int,
+    head_features: int,
+    num_heads: int,
+    attn_dtype: Optional[torch.dtype] = None,
+) -> nn.Module:
     scale = head_features**-0.5
     mid_features = head_features * num_heads
     to_out = nn.Linear(in_features=mid_features, out_features=features, bias=False)
 
     def forward(q: Tensor, k: Tensor, v: Tensor) -> Tensor:
-        h = num_heads
+        (b, n, _), h = q.shape, num_heads
         # Split heads
-        q, k, v = map(lambda t: rearrange(t, "b n (h d) -> b h n d", h=h), (q, k, v))
+        q, k, v = map(
+            lambda t: t.reshape(*t.shape[:2], h, -1).transpose(1, 2), (q, k, v)
+        )
         # Softmax rows and cols
         q = q.softmax(dim=-1) * scale
         k = k.softmax(dim=-2)
+        # Optionally attend in lower precision (e.g. bfloat16), softmax stays as is
+        dtype = q.dtype
+        if exists(attn_dtype):
+            q, k, v = q.to(attn_dtype), k.to(attn_dtype), v.to(attn_dtype)
         # Attend on channel dim
-        attn = einsum("... n d, ... n c -> ... d c", k, v)
-        out = einsum("... n d, ... d c -> ... n c", q, attn)
-        out = rearrange(out, "b h n d -> b n (h d)")
+        attn = k.transpose(-1, -2) @ v
+        out = q @ attn
+        out = out.transpose(1, 2).reshape(b, n, mid_features).to(dtype)
         return to_out(out)
 
     return Module([to_out], forward)
@@ -320,13 +385,12 @@ def FixedEmbedding(max_length: int, features: int):
     embedding = nn.Embedding(max_length, features)
 
     def forward(x: Tensor) -> Tensor:
-        batch_size, length, device = *x.shape[0:2], x.device
+        batch_size, length = x.shape[0:2]
         assert_message = "Input sequence length must be <= max_length"
         assert length <= max_length, assert_message
-        position = torch.arange(length, device=device)
-        fixed_embedding = embedding(position)
-        fixed_embedding = repeat(fixed_embedding, "n d -> b n d", b=batch_size)
-        return fixed_embedding
+        # Positions are always 0..length-1, so the lookup is a slice of the table
+        fixed_embedding = embedding.weight[:length]
+        return fixed_embedding.unsqueeze(0).expand(batch_size, -1, -1)
 
     return Module([embedding], forward)
 
@@ -357,29 +421,63 @@ class Attention(nn.Module):
                 max_length=max_length, features=features
             )
 
-        self.norm = nn.LayerNorm(features)
-        self.norm_context = nn.LayerNorm(context_features)
-        self.to_q = nn.Linear(
-            in_features=features, out_features=mid_features, bias=False
-        )
-        self.to_kv = nn.Linear(
-            in_features=context_features, out_features=mid_features * 2, bias=False
-        )
+        if self.use_context:
+            self.norm = nn.LayerNorm(features)
+            self.norm_context = nn.LayerNorm(context_features)
+            self.to_q = nn.Linear(
+                in_features=features, out_features=mid_features, bias=False
+            )
+            self.to_kv = nn.Linear(
+                in_features=context_features, out_features=mid_features * 2, bias=False
+            )
+        else:
+            # Self-attention: single packed projection for q, k, v, the norm affine
+            # is part of the projection (q and k,v had separate norms)
+            self.norm = nn.LayerNorm(features, elementwise_affine=False)
+            self.to_qkv = nn.Linear(
+                in_features=features, out_features=mid_features * 3, bias=True
+            )
+            nn.init.zeros_(self.to_qkv.bias)
         self.attention = attention_base_t(
             features, num_heads=num_heads, head_features=head_features
         )
 
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        # Fold norm affines of split to_q/to_kv self-attention checkpoints into the
+        # packed to_qkv: W (w * x + b) = (W diag(w)) x + W b
+        if not self.use_context and f"{prefix}to_q.weight" in state_dict:
+
+            def pop(name: str) -> Tensor:
+                return state_dict.pop(f"{prefix}{name}")
+
+            pairs = [
+                (pop("to_q.weight"), pop("norm.weight"), pop("norm.bias")),
+                (
+                    pop("to_kv.weight"),
+                    pop("norm_context.weight"),
+                    pop("norm_context.bias"),
+                ),
+            ]
+            weight = torch.cat([w * norm_weight for w, norm_weight, _ in pairs])
+            bias = torch.cat([w @ norm_bias for w, _, norm_bias in pairs])
+            state_dict[f"{prefix}to_qkv.weight"] = weight
+            state_dict[f"{prefix}to_qkv.bias"] = bias
+        super()._load_from_state_dict(state_dict, prefix, *args, **kwargs)
+
     def forward(self, x: Tensor, context: Optional[Tensor] = None) -> Tensor:
         assert_message = "You must provide a context when using context_features"
         assert not self.context_features or exists(context), assert_message
         skip = x
         if self.use_positional_embedding:
             x = x + self.positional_embedding(x)
-        # Use context if provided
-        context = context if exists(context) and self.use_context else x
-        # Normalize then compute q from input and k,v from context
-        x, context = self.norm(x), self.norm_context(context)
-        q, k, v = (self.to_q(x), *torch.chunk(self.to_kv(context), chunks=2, dim=-1))
+        if self.use_context:
+            # Normalize then compute q from input and k,v from context
+            x, context = self.norm(x), self.norm_context(context)
+            q = self.to_q(x)
+            k, v = torch.chunk(self.to_kv(context), chunks=2, dim=-1)
+        else:
+            # Normalize then compute q,k,v from input with one projection
+            q, k, v = torch.chunk(self.to_qkv(self.norm(x)), chunks=3, dim=-1)
         # Compute and return attention
         return skip + self.attention(q, k, v)
 
@@ -405,9 +503,9 @@ def Modulation(in_features: int, num_features: int) -> nn.Module:
     norm = nn.LayerNorm(in_features, elementwise_affine=False, eps=1e-6)
 
     def forward(x: Tensor, features: Tensor) -> Tensor:
-        scale_shift = to_scale_shift(features)
-        scale, shift = rearrange(scale_shift, "b d -> b 1 d").chunk(2, dim=-1)
-        return norm(x) * (1 + scale) + shift
+        scale_shift = to_scale_shift(features).unsqueeze(1)
+        scale, shift = scale_shift.chunk(2, dim=-1)
+        return torch.addcmul(shift, norm(x), scale + 1)
 
     return Module([to_scale_shift, norm], forward)
 
@@ -418,7 +516,16 @@ def MergeAdd():
 
 def MergeCat(dim: int, channels: int, scale: float = 2**-0.5) -> nn.Module:
     conv = Conv(dim=dim, in_channels=channels * 2, out_channels=channels, kernel_size=1)
-    return Module([conv], lambda x, y, *_: conv(torch.cat([x * scale, y], dim=1)))
+
+    conv_fn = getattr(F, f"conv{dim}d")
+
+    def forward(x: Tensor, y: Tensor, *args) -> Tensor:
+        # Scale the (small) x half of the 1x1 kernel instead of the x activation
+        w, bias = cast(Tensor, conv.weight), cast(Optional[Tensor], conv.bias)
+        weight = torch.cat([w[:, :channels] * scale, w[:, channels:]], dim=1)
+        return conv_fn(torch.cat([x, y], dim=1), weight, bias)
+
+    return Module([conv], forward)
 
 
 def MergeModulate(dim: int, channels: int, modulation_features: int):
@@ -448,10 +555,9 @@ class NumberEmbedder(nn.Module):
         self.to_out = nn.Linear(in_features=dim + 1, out_features=features)
 
     def to_embedding(self, x: Tensor) -> Tensor:
-        x = rearrange(x, "b -> b 1")
-        freqs = x * rearrange(self.weights, "d -> 1 d") * 2 * pi
-        fouriered = torch.cat((freqs.sin(), freqs.cos()), dim=-1)
-        fouriered = torch.cat((x, fouriered), dim=-1)
+        x = x.unsqueeze(-1)
+        freqs = x * (self.weights * (2 * pi))
+        fouriered = torch.cat((x, freqs.sin(), freqs.cos()), dim=-1)
         return self.to_out(fouriered)
 
     def forward(self, x: Union[Sequence[float], Tensor]) -> Tensor:
@@ -459,22 +565,46 @@ class NumberEmbedder(nn.Module):
             x = torch.tensor(x, device=self.weights.device)
         assert isinstance(x, Tensor)
         shape = x.shape
-        x = rearrange(x, "... -> (...)")
+        x = x.reshape(-1)
         return self.to_embedding(x).view(*shape, self.features)  # type: ignore
 
 
 class T5Embedder(nn.Module):
-    def __init__(self, model: str = "t5-base", max_length: int = 64):
+    def __init__(
+        self,
+        model: str = "t5-base",
+        max_length: int = 64,
+        cache_size: int = 0,
+        dtype: Optional[torch.dtype] = None,
+    ):
         super().__init__()
         from transformers import AutoTokenizer, T5EncoderModel
 
         self.tokenizer = AutoTokenizer.from_pretrained(model)
         self.transformer = T5EncoderModel.from_pretrained(model)
+        self.transformer.requires_grad_(False)
+        self.transformer.eval()
+        if exists(dtype):
+            self.transformer.to(dtype=dtype)  # type: ignore
         self.max_length = max_length
         self.embedding_features = self.transformer.config.d_model
+        # Opt-in LRU cache of per-text embeddings (kept on the transformer's device),
+        # rows are independent with fixed padding
+        self.cache_size = cache_size
+        self.cache: "OrderedDict[str, Tensor]" = OrderedDict()
+
+    def train(self, mode: bool = True) -> "T5Embedder":
+        # Transformer is frozen, always keep it in eval mode
+        super().train(mode)
+        self.transformer.eval()
+        return self
 
-    @torch.no_grad()
-    def forward(self, texts: Sequence[str]) -> Tensor:
+    def _apply(self, *args, **kwargs):
+        # Cached rows would be stale after device or dtype changes
+        self.cache.clear()
+        return super()._apply(*args, **kwargs)
+
+    def encode(self, texts: Sequence[str]) -> Tensor:
         encoded = self.tokenizer(
             texts,
             truncation=True,
@@ -487,14 +617,33 @@ class T5Embedder(nn.Module):
         input_ids = encoded["input_ids"].to(device)
         attention_mask = encoded["attention_mask"].to(device)
 
-        self.transformer.eval()
-
         embedding = self.transformer(
             input_ids=input_ids, attention_mask=attention_mask
         )["last_hidden_state"]
 
         return embedding
 
+    @torch.no_grad()
+    def forward(self, texts: Sequence[str]) -> Tensor:
+        if self.cache_size <= 0:
+            return self.encode(texts)
+        # Encode only texts not already cached, once each
+        rows = {text: self.cache[text] for text in texts if text in self.cache}
+        missing = [text for text in dict.fromkeys(texts) if text not in rows]
+        if missing:
+            # clone so cached rows don't keep the whole batch storage alive
+            encoded = self.encode(missing)
+            rows.update((text, row.clone()) for text, row in zip(missing, encoded))
+        # Update cache recency and evict least recently used
+        for text, row in rows.items():
+            self.cache[text] = row
+            self.cache.move_to_end(text)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+        device = next(self.transformer.parameters()).device
+        return torch.stack([rows[text] for text in texts]).to(device)
+
 
 """
 Plugins
@@ -510,6 +659,20 @@ def rand_bool(shape: Any, proba: float, device: Any = None) -> Tensor:
         return torch.bernoulli(torch.full(shape, proba, device=device)).to(torch.bool)
 
 
+def double_batch(value: Any, batch_size: int) -> Any:
+    """Repeats batch aligned values (tensors or sequences of length batch_size) twice
+    on batch dim, sequences of tensors (e.g. channels) per item, others as is"""
+    if torch.is_tensor(value):
+        is_aligned = value.ndim > 0 and value.shape[0] == batch_size
+        return torch.cat([value, value], dim=0) if is_aligned else value
+    if isinstance(value, (list, tuple)):
+        if any(torch.is_tensor(v) for v in value):
+            return type(value)(double_batch(v, batch_size) for v in value)
+        if len(value) == batch_size:
+            return type(value)([*value, *value])
+    return value
+
+
 def ClassifierFreeGuidancePlugin(
     net_t: Type[nn.Module],
     embedding_max_length: int,
@@ -542,10 +705,15 @@ def ClassifierFreeGuidancePlugin(
                 )
                 embedding = torch.where(batch_mask, embedding_mask, embedding)
 
-            if embedding_scale != 1.0:
-                # Compute both normal and fixed embedding outputs
-                out = net(x, embedding=embedding, **kwargs)
-                out_masked = net(x, embedding=embedding_mask, **kwargs)
+            if embedding_scale != 1.0 and embedding_mask_proba == 1.0:
+                # Fully masked, guided output equals the fixed embedding output
+                return net(x, embedding=embedding_mask, **kwargs)
+            elif embedding_scale != 1.0:
+                # Compute both normal and fixed embedding outputs in one batch
+                embedding = torch.cat([embedding, embedding_mask], dim=0)
+                kwargs = {key: double_batch(v, b) for key, v in kwargs.items()}
+                out_both = net(double_batch(x, b), embedding=embedding, **kwargs)
+                out, out_masked = out_both.chunk(2, dim=0)
                 # Scale conditional output using classifier-free guidance
                 return out_masked + (out - out_masked) * embedding_scale
             else:
@@ -562,7 +730,12 @@ def TimeConditioningPlugin(
 ) -> Callable[..., nn.Module]:
     """Adds time conditioning (e.g. for diffusion)"""
 
-    def Net(modulation_features: Optional[int] = None, **kwargs) -> nn.Module:
+    def Net(
+        modulation_features: Optional[int] = None,
+        compile_model: bool = False,
+        compile_mode: str = "reduce-overhead",
+        **kwargs,
+    ) -> nn.Module:
         msg = "TimeConditioningPlugin requires modulation_features"
         assert exists(modulation_features), msg
 
@@ -574,6 +747,8 @@ def TimeConditioningPlugin(
             times=num_layers,
         )
         net = net_t(modulation_features=modulation_features, **kwargs)  # type: ignore
+        if compile_model:
+            net.compile(mode=compile_mode, fullgraph=False)
 
         def forward(
             x: Tensor,
@@ -607,10 +782,17 @@ def TextConditioningPlugin(
     assert hasattr(embedder, "embedding_features"), msg
     features: int = embedder.embedding_features  # type: ignore
 
-    def Net(embedding_features: int = features, **kwargs) -> nn.Module:
+    def Net(
+        embedding_features: int = features,
+        compile_model: bool = False,
+        compile_mode: str = "reduce-overhead",
+        **kwargs,
+    ) -> nn.Module:
         msg = f"TextConditioningPlugin requires embedding_features={features}"
         assert embedding_features == features, msg
         net = net_t(embedding_features=embedding_features, **kwargs)  # type: ignore
+        if compile_model:
+            net.compile(mode=compile_mode, fullgraph=False)
 
         def forward(
             x: Tensor, text: Sequence[str], embedding: Optional[Tensor] = None, **kwargs
@@ -656,10 +838,15 @@ def TabularDataClassifierFreeGuidancePlugin(
                 )
                 embedding = torch.where(batch_mask, embedding_mask, embedding)
 
-            if embedding_scale != 1.0:
-                # Compute both normal and fixed embedding outputs
-                out = net(x, embedding=embedding, **kwargs)
-                out_masked = net(x, embedding=embedding_mask, **kwargs)
+            if embedding_scale != 1.0 and embedding_mask_proba == 1.0:
+                # Fully masked, guided output equals the fixed embedding output
+                return net(x, embedding=embedding_mask, **kwargs)
+            elif embedding_scale != 1.0:
+                # Compute both normal and fixed embedding outputs in one batch
+                embedding = torch.cat([embedding, embedding_mask], dim=0)
+                kwargs = {key: double_batch(v, b) for key, v in kwargs.items()}
+                out_both = net(double_batch(x, b), embedding=embedding, **kwargs)
+                out, out_masked = out_both.chunk(2, dim=0)
                 # Scale conditional output using classifier-free guidance
                 return out_masked + (out - out_masked) * embedding_scale
             else:
@@ -731,35 +918,58 @@ class TabularDataEmbeddingGenerator(torch.nn.Module):
         else:
             self.skip_embedding = False
 
-        self.post_embed_dim = int(input_dim + np.sum(cat_emb_dims) - len(cat_emb_dims))
-
-        self.embeddings = torch.nn.ModuleList()
-
-        for cat_dim, emb_dim in zip(cat_dims, cat_emb_dims):
-            self.embeddings.append(torch.nn.Embedding(cat_dim, emb_dim))
+        self.post_embed_dim = int(input_dim + sum(cat_emb_dims) - len(cat_emb_dims))
 
         # record continuous indices
         self.continuous_idx = torch.ones(input_dim, dtype=torch.bool)
         self.continuous_idx[cat_idxs] = 0
-
-        # update group matrix
-        n_groups = group_matrix.shape[0]
-        self.embedding_group_matrix = torch.empty((n_groups, self.post_embed_dim),
-                                                  device=group_matrix.device)
-        for group_idx in range(n_groups):
-            post_emb_idx = 0
-            cat_feat_counter = 0
-            for init_feat_idx in range(input_dim):
-                if self.continuous_idx[init_feat_idx] == 1:
-                    # this means that no embedding is applied to this column
-                    self.embedding_group_matrix[group_idx, post_emb_idx] = group_matrix[group_idx, init_feat_idx]  # noqa
-                    post_emb_idx += 1
-                else:
-                    # this is a categorical feature which creates multiple embeddings
-                    n_embeddings = cat_emb_dims[cat_feat_counter]
-                    self.embedding_group_matrix[group_idx, post_emb_idx:post_emb_idx+n_embeddings] = group_matrix[group_idx, init_feat_idx] / n_embeddings  # noqa
-                    post_emb_idx += n_embeddings
-                    cat_feat_counter += 1
+        cont_positions = torch.nonzero(self.continuous_idx).squeeze(1)
+        cat_positions = torch.nonzero(~self.continuous_idx).squeeze(1)
+        self.register_buffer("cont_positions", cont_positions, persistent=False)
+        self.register_buffer("cat_positions", cat_positions, persistent=False)
+
+        # all categorical embeddings packed in one zero padded table, the i-th
+        # embedding (in column order) owns rows cat_offsets[i]:cat_offsets[i+1]
+        n_cont, n_cat = len(cont_positions), len(cat_dims)
+        max_emb_dim = max(cat_emb_dims)
+        self.cat_emb_dims = list(cat_emb_dims)
+        self.cat_weight = torch.nn.Parameter(torch.zeros(sum(cat_dims), max_emb_dim))
+        cat_offsets = torch.tensor([0, *cat_dims[:-1]]).cumsum(0)
+        self.register_buffer("cat_offsets", cat_offsets, persistent=False)
+        self.register_buffer("cat_dims", torch.tensor(cat_dims), persistent=False)
+        with torch.no_grad():
+            for offset, cat_dim, emb_dim in zip(cat_offsets, cat_dims, cat_emb_dims):
+                self.cat_weight[offset : offset + cat_dim, :emb_dim].normal_()
+
+        # gather from [continuous, flattened padded embeddings] to column order,
+        # recording the input column and its split for each output column
+        output_perm: List[int] = []
+        post_src: List[int] = []
+        post_div: List[int] = []
+        cont_iter = iter(range(n_cont))
+        cat_iter = iter(zip(range(n_cat), cat_emb_dims))
+        for init_feat_idx, is_continuous in enumerate(self.continuous_idx.tolist()):
+            if is_continuous:
+                # this means that no embedding is applied to this column
+                output_perm.append(next(cont_iter))
+                post_src.append(init_feat_idx)
+                post_div.append(1)
+            else:
+                # this is a categorical feature which creates multiple embeddings
+                cat_counter, n_embeddings = next(cat_iter)
+                start = n_cont + cat_counter * max_emb_dim
+                output_perm += range(start, start + n_embeddings)
+                post_src += [init_feat_idx] * n_embeddings
+                post_div += [n_embeddings] * n_embeddings
+        self.register_buffer("output_perm", torch.tensor(output_perm), persistent=False)
+
+        # update group matrix, embedded columns share their original importance
+        device = group_matrix.device
+        post_src_t = torch.tensor(post_src, device=device)
+        post_div_t = torch.tensor(post_div, device=device)
+        self.embedding_group_matrix = (group_matrix[:, post_src_t] / post_div_t).to(
+            torch.get_default_dtype()
+        )
 
     def forward(self, x):
         """
@@ -771,17 +981,24 @@ class TabularDataEmbeddingGenerator(torch.nn.Module):
             # no embeddings required
             return x
 
-        cols = []
-        cat_feat_counter = 0
-        for feat_init_idx, is_continuous in enumerate(self.continuous_idx):
-            # Enumerate through continuous idx boolean mask to apply embeddings
-            if is_continuous:
-                cols.append(x[:, feat_init_idx].float().view(-1, 1))
-            else:
-                cols.append( 
-                    self.embeddings[cat_feat_counter](x[:, feat_init_idx].long())
-                )
-                cat_feat_counter += 1
-        # concat
-        post_embeddings = torch.cat(cols, dim=1)
-        return post_embeddings
\ No newline at end of file
+        b = x.shape[0]
+        cont = x.index_select(1, self.cont_positions).float()
+        cat_codes = x.index_select(1, self.cat_positions).long()
+        # codes out of a feature's range would read another feature's rows
+        if not ((cat_codes >= 0) & (cat_codes < self.cat_dims)).all():
+            raise IndexError("categorical code out of range of its embedding")
+        cat = F.embedding(cat_codes + self.cat_offsets, self.cat_weight).view(b, -1)
+        # concat and reorder to original column order
+        post_embeddings = torch.cat([cont, cat], dim=1)
+        return post_embeddings.index_select(1, self.output_perm)
+
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        # Remap per-feature embeddings.{i}.weight checkpoints to the packed table
+        n_cat = 0 if self.skip_embedding else len(self.cat_emb_dims)
+        keys = [f"{prefix}embeddings.{i}.weight" for i in range(n_cat)]
+        if n_cat > 0 and all(key in state_dict for key in keys):
+            weights = [state_dict.pop(key) for key in keys]
+            max_emb_dim = self.cat_weight.shape[1]
+            padded = [F.pad(w, (0, max_emb_dim - w.shape[1])) for w in weights]
+            state_dict[f"{prefix}cat_weight"] = torch.cat(padded)
+        super()._load_from_state_dict(state_dict, prefix, *args, **kwargs)
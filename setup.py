@@ -12,7 +12,7 @@ setup(
     url="https://github.com/archinetai/a-unet",
     keywords=["artificial intelligence", "deep learning"],
     install_requires=[
-        "torch>=1.6",
+        "torch>=2.2",
         "data-science-types>=0.2",
         "einops>=0.6.0",
     ],
@@ -0,0 +1,140 @@
+import pytest
+import torch
+
+from a_unet.blocks import TabularDataEmbeddingGenerator
+
+
+def test_tabular_embedding_remap_and_column_order():
+    # Categorical columns 1, 3, 5 (given out of order), embeddings follow column order
+    input_dim, cat_idxs = 7, [5, 1, 3]
+    cat_dims, cat_emb_dims = [3, 5, 4], [2, 4, 3]
+    embedder = TabularDataEmbeddingGenerator(
+        input_dim, cat_dims, cat_idxs, cat_emb_dims, torch.rand(2, input_dim)
+    )
+    # Checkpoint with per-feature embeddings
+    weights = [torch.randn(n, d) for n, d in zip(cat_dims, cat_emb_dims)]
+    embedder.load_state_dict(
+        {f"embeddings.{i}.weight": w for i, w in enumerate(weights)}
+    )
+
+    x = torch.rand(6, input_dim)
+    for column, cat_dim in zip([1, 3, 5], cat_dims):
+        x[:, column] = torch.randint(0, cat_dim, (6,))
+
+    cols, cat_counter = [], 0
+    for column in range(input_dim):
+        if column in cat_idxs:
+            cols.append(weights[cat_counter][x[:, column].long()])
+            cat_counter += 1
+        else:
+            cols.append(x[:, column : column + 1])
+    expected = torch.cat(cols, dim=1)
+
+    assert embedder.post_embed_dim == expected.shape[1]
+    assert torch.equal(embedder(x), expected)
+
+
+def test_tabular_embedding_out_of_range_code():
+    group_matrix = torch.rand(1, 2)
+    embedder = TabularDataEmbeddingGenerator(2, [3, 4], [0, 1], [2, 2], group_matrix)
+    # Code 3 in feature 0 would otherwise read row 0 of feature 1
+    with pytest.raises(IndexError):
+        embedder(torch.tensor([[3.0, 0.0]]))
+    with pytest.raises(IndexError):
+        embedder(torch.tensor([[0.0, -1.0]]))
+    assert embedder(torch.tensor([[2.0, 3.0]])).shape == (1, 4)
+
+
+class StubTokenizer:
+    def __init__(self):
+        self.texts = []
+
+    def __call__(self, texts, max_length, **kwargs):
+        self.texts += texts
+        ids = torch.zeros(len(texts), max_length, dtype=torch.long)
+        for i, text in enumerate(texts):
+            codes = [ord(c) % 100 + 1 for c in text][:max_length]
+            ids[i, : len(codes)] = torch.tensor(codes)
+        return {"input_ids": ids, "attention_mask": (ids > 0).long()}
+
+
+class StubEncoder(torch.nn.Module):
+    class config:
+        d_model = 4
+
+    def __init__(self):
+        super().__init__()
+        self.embedding = torch.nn.Embedding(128, 4)
+
+    def forward(self, input_ids, attention_mask):
+        return {"last_hidden_state": self.embedding(input_ids)}
+
+
+def test_t5_embedder_cache(monkeypatch):
+    transformers = pytest.importorskip("transformers")
+    from a_unet.blocks import T5Embedder
+
+    tokenizer = StubTokenizer()
+    monkeypatch.setattr(
+        transformers.AutoTokenizer, "from_pretrained", lambda *a, **k: tokenizer
+    )
+    monkeypatch.setattr(
+        transformers.T5EncoderModel, "from_pretrained", lambda *a, **k: StubEncoder()
+    )
+    embedder = T5Embedder(max_length=8, cache_size=2)
+
+    texts = ["a dog", "a cat", "a dog"]
+    embedding = embedder(texts)
+    # Each distinct text encoded once, same result as uncached encoding
+    assert tokenizer.texts == ["a dog", "a cat"]
+    assert torch.equal(embedding, embedder.encode(texts))
+    # Cached rows own their storage (not views of the batch)
+    row = embedder.cache["a dog"]
+    assert row.untyped_storage().nbytes() == row.numel() * row.element_size()
+
+    # Hits only encode misses, least recently used ("a cat") is evicted
+    tokenizer.texts = []
+    embedder(["a dog", "a bird"])
+    assert tokenizer.texts == ["a bird"]
+    assert list(embedder.cache) == ["a dog", "a bird"]
+
+    # Device or dtype changes clear the cache
+    embedder.to(torch.float64)
+    assert len(embedder.cache) == 0
+    assert embedder(["a dog"]).dtype == torch.float64
+
+
+def test_attention_loads_split_projection_checkpoint():
+    from a_unet.blocks import Attention
+
+    features, head_features, num_heads = 16, 4, 2
+    mid_features = head_features * num_heads
+    # Checkpoint with split to_q/to_kv and separate (non-identity) norms
+    state_dict = {
+        "norm.weight": torch.randn(features),
+        "norm.bias": torch.randn(features),
+        "norm_context.weight": torch.randn(features),
+        "norm_context.bias": torch.randn(features),
+        "to_q.weight": torch.randn(mid_features, features),
+        "to_kv.weight": torch.randn(mid_features * 2, features),
+        "attention.blocks.0.weight": torch.randn(features, mid_features),
+    }
+    attention = Attention(features, head_features=head_features, num_heads=num_heads)
+    attention.load_state_dict(state_dict)
+
+    def norm(x, name):
+        weight, bias = state_dict[f"{name}.weight"], state_dict[f"{name}.bias"]
+        return torch.nn.functional.layer_norm(x, (features,), weight, bias)
+
+    def split_heads(t):
+        return t.reshape(*t.shape[:2], num_heads, -1).transpose(1, 2)
+
+    x = torch.randn(2, 10, features)
+    q = norm(x, "norm") @ state_dict["to_q.weight"].T
+    k, v = (norm(x, "norm_context") @ state_dict["to_kv.weight"].T).chunk(2, dim=-1)
+    sim = split_heads(q) @ split_heads(k).transpose(-1, -2) * head_features**-0.5
+    out = sim.softmax(dim=-1) @ split_heads(v)
+    out = out.transpose(1, 2).reshape(2, 10, mid_features)
+    expected = x + out @ state_dict["attention.blocks.0.weight"].T
+
+    assert torch.allclose(attention(x), expected, atol=1e-4)
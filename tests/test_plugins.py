@@ -0,0 +1,102 @@
+import torch
+import torch._dynamo
+
+from a_unet import ClassifierFreeGuidancePlugin, TimeConditioningPlugin
+from a_unet.apex import (
+    AttentionItem,
+    ConvNextV2Item,
+    CrossAttentionItem,
+    FeedForwardItem,
+    LinearAttentionItem,
+    ModulationItem,
+    ResnetItem,
+    SkipCat,
+    XBlock,
+    XUNet,
+)
+
+
+def test_classifier_free_guidance_with_list_time():
+    # README ApeX example (scaled down) with CFG and time given as a list
+    UNet = ClassifierFreeGuidancePlugin(TimeConditioningPlugin(XUNet), 4)
+    items = [ResnetItem, ModulationItem, AttentionItem, CrossAttentionItem]
+    unet = UNet(
+        dim=2,
+        in_channels=2,
+        blocks=[
+            XBlock(channels=8, factor=2, items=items),
+            XBlock(channels=16, factor=2, items=items),
+        ],
+        skip_t=SkipCat,
+        attention_features=8,
+        attention_heads=2,
+        embedding_features=16,
+        modulation_features=16,
+        resnet_groups=4,
+    )
+    x = torch.randn(2, 2, 16, 16)
+    time = [0.2, 0.5]
+    embedding = torch.randn(2, 4, 16)
+
+    with torch.no_grad():
+        y = unet(x, time=time, embedding=embedding, embedding_scale=5.0)
+        out = unet(x, time=time, embedding=embedding)
+        out_masked = unet(x, time=time, embedding=embedding, embedding_mask_proba=1.0)
+
+    assert y.shape == x.shape
+    assert torch.allclose(y, out_masked + (out - out_masked) * 5.0, atol=1e-4)
+
+
+def test_time_conditioning_traces_to_single_graph():
+    items = [
+        ResnetItem,
+        ModulationItem,
+        AttentionItem,
+        CrossAttentionItem,
+        FeedForwardItem,
+        LinearAttentionItem,
+        ConvNextV2Item,
+    ]
+    unet = TimeConditioningPlugin(XUNet)(
+        dim=1,
+        in_channels=2,
+        blocks=[
+            XBlock(channels=8, factor=2, items=items),
+            XBlock(channels=16, factor=2, items=items),
+        ],
+        skip_t=SkipCat,
+        attention_features=4,
+        attention_heads=2,
+        attention_multiplier=2,
+        embedding_features=16,
+        modulation_features=16,
+        resnet_groups=4,
+    )
+    x, time, embedding = torch.randn(2, 2, 16), torch.rand(2), torch.randn(2, 4, 16)
+
+    explanation = torch._dynamo.explain(unet)(x, time=time, embedding=embedding)
+
+    assert explanation.graph_break_count == 0
+    assert explanation.graph_count == 1
+
+
+def test_time_conditioning_compile_model():
+    def UNet(**kwargs):
+        torch.manual_seed(0)
+        return TimeConditioningPlugin(XUNet)(
+            dim=1,
+            in_channels=2,
+            blocks=[XBlock(channels=8, factor=2, items=[ResnetItem, ModulationItem])],
+            modulation_features=16,
+            resnet_groups=4,
+            **kwargs,
+        )
+
+    unet, unet_compiled = UNet(), UNet(compile_model=True)
+    x, time = torch.randn(2, 2, 16), torch.rand(2)
+
+    with torch.no_grad():
+        y, y_compiled = unet(x, time=time), unet_compiled(x, time=time)
+
+    assert unet_compiled.state_dict().keys() == unet.state_dict().keys()
+    assert torch.allclose(y_compiled, y, atol=1e-5)